@@ -1,14 +1,19 @@
 #!/usr/bin/env python3
 """LXMF AI Bot — bridges LXMF messages to an LLM (Claude CLI, Anthropic API, or OpenAI-compatible)."""
 
+import asyncio
+import itertools
 import json
 import os
+import re
 import shutil
 import signal
 import subprocess
 import sys
 import time
 import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import RNS
@@ -24,18 +29,56 @@ try:
 except ImportError:
     OpenAI = None
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Claude CLI output is parsed straight from bytes; orjson is much faster on
+# large outputs, the stdlib parser accepts bytes too.
+if orjson is not None:
+    _json_loads = orjson.loads
+    _json_dumps_bytes = orjson.dumps
+else:
+    _json_loads = json.loads
+
+    def _json_dumps_bytes(obj) -> bytes:
+        return json.dumps(obj).encode()
+
 DATA_DIR = Path.home() / ".lxmf-claude"
 IDENTITY_PATH = DATA_DIR / "identity"
 STORAGE_PATH = DATA_DIR / "storage"
+STATE_PATH = DATA_DIR / "state.json"
+STATE_SAVE_INTERVAL = 60  # seconds between background saves of per-sender state
 
 MAX_HISTORY = 10        # message pairs per sender (API backends only)
+MAX_MESSAGE_CHARS = 2000  # per-message cap on stored history
+ARCHIVE_KEEP = 6        # most recent messages kept verbatim when history is compacted
+ARCHIVED_CONTENT = "[archived]"
 MAX_RESPONSE_CHARS = 1500
+_TRUNC_AT = MAX_RESPONSE_CHARS - 3  # room for the "..." marker on truncated replies
+STREAM_CHUNK_CHARS = 200  # streamed replies are sent once this much text ends in a sentence
+MAX_TOKENS = 1024       # completion limit; kept constant so cached prefixes stay valid
 OLLAMA_BASE_URL = "http://localhost:11434/v1"
 OLLAMA_MODEL = "glm-5:cloud"
 ANTHROPIC_MODEL = "claude-haiku-4-5-20251001"
 CLI_MODEL = "haiku"
 CLI_TIMEOUT = 120       # seconds per CLI invocation
+CLI_MAX_PROCS = 4       # persistent claude processes kept running at once
+CLI_STDERR_LINES = 20   # stderr lines kept from each persistent claude process for error reports
+BUNDLE_MS = int(os.environ.get("BUNDLE_MS", "200"))  # window for coalescing replies to one destination
+BUNDLE_SEPARATOR = "\n---\n"
+MAX_BUNDLE_CHARS = 3000  # largest coalesced LXMF message; longer bundles are split
+MAX_WORKERS = 8         # inbound messages handled concurrently
+PATH_WAIT = 5           # seconds to wait for path discovery before dropping a reply
+DEST_CACHE_TTL = 300    # seconds an outbound RNS.Destination is reused
 DISPLAY_NAME = "AI Bot"
+MAX_SENDERS = 1024      # senders whose history/session is kept in memory
+SENDER_TTL = 3600       # seconds idle before a sender's history/session is dropped
+RESPONSE_CACHE_TTL = 1800       # seconds a reply is reused for an identical message
+RESPONSE_CACHE_MIN_CHARS = 8    # shorter messages are too ambiguous to cache
+RESPONSE_CACHE_MAX = 1024       # cached replies kept at once, across all senders
+CONV_HIST_CACHE_THRESHOLD = 6   # message pairs after which replies depend too much on context to cache
 
 SYSTEM_PROMPT = (
     "You are a helpful assistant reachable over a low-bandwidth LoRa mesh network (Reticulum/LXMF). "
@@ -43,11 +86,79 @@ SYSTEM_PROMPT = (
     "If a topic needs a longer answer, give a brief summary and offer to elaborate."
 )
 
-# Per-sender state
-conversations: dict[str, list[dict]] = {}      # API backends: message history
-conversations_lock = threading.Lock()
-cli_sessions: dict[str, str] = {}              # CLI backend: sender_hash -> session_id
-cli_sessions_lock = threading.Lock()
+# Anthropic takes the system prompt as content blocks so it can be marked as a
+# prompt-cache breakpoint. Built once so the cached prefix is byte-identical.
+ANTHROPIC_SYSTEM = [
+    {"type": "text", "text": SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}},
+]
+OPENAI_SYSTEM = {"role": "system", "content": SYSTEM_PROMPT}
+
+# Claude CLI invocation, built once. The CLI must use its own login rather
+# than an API key, and must not think it is nested inside another session.
+_CLI_ONESHOT_CMD = ("claude", "-p", "--output-format", "json", "--model", CLI_MODEL)
+_CLI_STREAM_CMD = (
+    "claude", "-p",
+    "--input-format", "stream-json",
+    "--output-format", "stream-json",
+    "--verbose",
+    "--model", CLI_MODEL,
+)
+_CLI_ENV = {k: v for k, v in os.environ.items() if k not in ("CLAUDECODE", "ANTHROPIC_API_KEY")}
+_CLI_NEW_SESSION_ARGS = ("--system-prompt", SYSTEM_PROMPT)
+
+
+class SenderState:
+    """Everything kept in memory for one sender."""
+
+    __slots__ = ("history", "session_id", "turns", "last_seen")
+
+    def __init__(self):
+        self.history: tuple[dict, ...] = ()  # API backends: message history, replaced not mutated
+        self.session_id: str | None = None  # CLI backend: session to resume
+        self.turns = 0                      # replies given, including ones trimmed from history
+        self.last_seen = time.monotonic()
+
+
+# Per-sender state, ordered least- to most-recently used and bounded by
+# MAX_SENDERS / SENDER_TTL.
+senders: OrderedDict[str, SenderState] = OrderedDict()
+senders_lock = threading.Lock()
+
+# Exact-match reply cache: (sender_hash, normalized message) -> (stored_at, reply),
+# in insertion order so expired entries are always at the front.
+response_cache: OrderedDict[tuple[str, str], tuple[float, str]] = OrderedDict()
+response_cache_lock = threading.Lock()
+
+# Messages whose answer depends on when they are asked are never cached.
+_TIME_SENSITIVE = re.compile(
+    r"\d{1,2}:\d{2}|\d{4}-\d{2}-\d{2}|\b(now|today|tonight|tomorrow|yesterday|time|date|latest|current)\b"
+)
+
+# Where a streamed reply may be split between messages
+_SENTENCE_END = re.compile(r"[.!?](?=\s)|\n")
+
+# CLI backend: one persistent `claude` process per recent sender, least- to
+# most-recently used. None until stream-json is known to work, then True/False.
+cli_procs: OrderedDict[str, "CliProcess"] = OrderedDict()
+cli_procs_lock = threading.Lock()
+cli_stream_supported: bool | None = None
+
+# Inbound messages waiting for their sender's current turn to finish, per
+# sender hash. A sender has an entry only while one of its turns is running.
+pending_turns: dict[str, deque] = {}
+pending_turns_lock = threading.Lock()
+
+# Outbound replies waiting out the bundle window or path discovery, per
+# destination hash, as [reply_id, text] entries. Only touched from send_loop,
+# so it needs no lock.
+send_queue: dict[bytes, list[list]] = {}
+_reply_ids = itertools.count()  # tells apart the chunks of replies streamed at once
+_send_tasks: set[asyncio.Task] = set()
+
+# Outbound LXMF destinations by hash -> (created_at, destination), so identity
+# recall and key parsing are skipped for recent senders. Dropped on failure.
+dest_cache: dict[bytes, tuple[float, RNS.Destination]] = {}
+dest_cache_lock = threading.Lock()
 
 # Set at startup based on available backend
 backend: str = None       # "claude-cli", "anthropic", or "openai"
@@ -55,6 +166,8 @@ llm_client = None         # anthropic.Anthropic or OpenAI instance (API backends
 model: str = None
 lxm_router: LXMF.LXMRouter = None
 delivery_destination: RNS.Destination = None
+executor: ThreadPoolExecutor = None
+send_loop: asyncio.AbstractEventLoop = None  # runs all outbound sends, on its own thread
 shutdown_event = threading.Event()
 
 
@@ -73,135 +186,682 @@ def get_or_create_identity() -> RNS.Identity:
     return identity
 
 
-def _run_claude_cli(sender_hash: str, user_message: str) -> str:
-    """Call claude -p, resuming an existing session if one exists for this sender."""
-    stripped = user_message.strip()
+def _get_sender(sender_hash: str) -> SenderState:
+    """Return a sender's state, marking it most recently used. Caller holds senders_lock."""
+    now = time.monotonic()
+    state = senders.get(sender_hash)
+    if state is None:
+        state = senders[sender_hash] = SenderState()
+    else:
+        senders.move_to_end(sender_hash)
+    state.last_seen = now
+
+    # The front of the store is always the least recently used sender, so
+    # both the capacity and idle checks only ever need to look there. The
+    # sender just touched is at the back, which bounds the loop.
+    while len(senders) > MAX_SENDERS or now - next(iter(senders.values())).last_seen > SENDER_TTL:
+        evicted, _ = senders.popitem(last=False)
+        _purge_cached_responses(evicted)
+
+    return state
+
+
+def load_state():
+    """Restore per-sender history and CLI sessions saved by a previous run."""
+    if not STATE_PATH.exists():
+        return
+    try:
+        with open(STATE_PATH) as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        RNS.log(f"Could not load saved state from {STATE_PATH}: {e}", RNS.LOG_WARNING)
+        return
+
+    saved_senders = data.get("senders") if isinstance(data, dict) else None
+    if not isinstance(saved_senders, dict):
+        RNS.log(f"Ignoring saved state in {STATE_PATH}: unexpected format", RNS.LOG_WARNING)
+        return
+
+    # Saved oldest first, so insertion order restores the LRU order
+    skipped = 0
+    with senders_lock:
+        for sender_hash, saved in saved_senders.items():
+            if not isinstance(saved, dict):
+                skipped += 1
+                continue
+            history = saved.get("history", [])
+            session_id = saved.get("session_id")
+            turns = saved.get("turns", 0)
+            if (
+                not isinstance(history, list)
+                or not all(_is_saved_message(m) for m in history)
+                or not isinstance(session_id, (str, type(None)))
+                or not isinstance(turns, int)
+            ):
+                skipped += 1
+                continue
+            state = senders[sender_hash] = SenderState()
+            state.history = tuple({"role": m["role"], "content": m["content"]} for m in history)
+            state.session_id = session_id
+            state.turns = turns
+        count = len(senders)
+    if skipped:
+        RNS.log(f"Skipped {skipped} malformed sender(s) in {STATE_PATH}", RNS.LOG_WARNING)
+    RNS.log(f"Restored state for {count} sender(s) from {STATE_PATH}", RNS.LOG_INFO)
+
+
+def _is_saved_message(message) -> bool:
+    # Anything else would be resent to the API on every turn and fail each time
+    return (
+        isinstance(message, dict)
+        and message.get("role") in ("user", "assistant")
+        and isinstance(message.get("content"), str)
+    )
+
+
+_last_saved_state: str | None = None
+# The background saver and shutdown can both save; they share one .tmp file.
+_save_state_lock = threading.Lock()
 
-    # Handle /clear locally
-    if stripped.lower() in ("/clear", "/reset"):
-        with cli_sessions_lock:
-            cli_sessions.pop(sender_hash, None)
-        return "Conversation cleared."
 
-    with cli_sessions_lock:
-        session_id = cli_sessions.get(sender_hash)
+def save_state():
+    """Write per-sender state to STATE_PATH atomically, if it changed since the last save."""
+    global _last_saved_state
+    with _save_state_lock:
+        with senders_lock:
+            snapshot = {
+                sender_hash: {"history": state.history, "session_id": state.session_id, "turns": state.turns}
+                for sender_hash, state in senders.items()
+            }
+        serialized = json.dumps({"senders": snapshot})
+        if serialized == _last_saved_state:
+            return
+
+        tmp_path = STATE_PATH.with_suffix(".tmp")
+        try:
+            # Conversations are private, so keep the file readable by the owner only
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                os.fchmod(f.fileno(), 0o600)  # a leftover .tmp keeps its old mode otherwise
+                f.write(serialized)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, STATE_PATH)
+            _last_saved_state = serialized
+        except OSError as e:
+            RNS.log(f"Could not save state to {STATE_PATH}: {e}", RNS.LOG_WARNING)
+
 
-    # Build command: resume existing session, or start new one
-    cmd = ["claude", "-p", "--output-format", "json", "--model", CLI_MODEL]
+def _state_saver():
+    while not shutdown_event.wait(STATE_SAVE_INTERVAL):
+        save_state()
+
+
+def _cli_command(base: tuple[str, ...], session_id: str | None) -> list[str]:
+    # Resume an existing session, or start a new one
     if session_id:
-        cmd.extend(["--resume", session_id])
-    else:
-        cmd.extend(["--system-prompt", SYSTEM_PROMPT])
+        return [*base, "--resume", session_id]
+    return [*base, *_CLI_NEW_SESSION_ARGS]
+
+
+class CliStreamError(Exception):
+    """The persistent claude process died or never spoke stream-json.
+
+    `silent` is set when the process exited without emitting a single event,
+    and `resumed` when it had been started with --resume. A silent fresh
+    process suggests the CLI doesn't support stream-json; a silent resumed
+    one suggests the session can't be resumed.
+    """
+
+    def __init__(self, message: str, silent: bool = False, resumed: bool = False):
+        super().__init__(message)
+        self.silent = silent
+        self.resumed = resumed
+
 
-    env = os.environ.copy()
-    env.pop("CLAUDECODE", None)
-    env.pop("ANTHROPIC_API_KEY", None)
+class CliProcess:
+    """A long-lived `claude -p` process exchanging stream-json with one sender.
 
+    Keeping the process alive avoids paying CLI startup and session reload on
+    every message. Turns are serialised by `lock`.
+    """
+
+    def __init__(self, session_id: str | None):
+        self.proc = subprocess.Popen(
+            _cli_command(_CLI_STREAM_CMD, session_id),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env=_CLI_ENV,
+        )
+        # Drained continuously so a chatty CLI can never block on a full pipe
+        self.stderr_tail: deque[str] = deque(maxlen=CLI_STDERR_LINES)
+        self._stderr_reader = threading.Thread(target=self._drain_stderr, daemon=True)
+        self._stderr_reader.start()
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+        self.closed = False
+        self.timed_out = False
+        self.resumed = session_id is not None
+        self.saw_output = False
+
+    def alive(self) -> bool:
+        return not self.closed and self.proc.poll() is None
+
+    def _kill(self):
+        self.timed_out = True
+        self.proc.kill()
+
+    def _drain_stderr(self):
+        for line in self.proc.stderr:
+            line = line.decode(errors="replace").strip()
+            if line:
+                self.stderr_tail.append(line)
+
+    def ask(self, user_message: str) -> dict:
+        """Send one user turn and return the terminating result event. Caller holds `lock`."""
+        if not self.alive():
+            self._stderr_reader.join(timeout=1)
+            raise self._error("claude process is not running")
+
+        event = {"type": "user", "message": {"role": "user", "content": user_message}}
+        killer = threading.Timer(CLI_TIMEOUT, self._kill)
+        killer.start()
+        try:
+            try:
+                self.proc.stdin.write(_json_dumps_bytes(event) + b"\n")
+                self.proc.stdin.flush()
+            except (BrokenPipeError, ValueError) as e:
+                raise self._error(f"cannot write to claude process: {e}") from e
+
+            for line in self.proc.stdout:
+                try:
+                    data = _json_loads(line)
+                except ValueError:
+                    continue
+                self.saw_output = True
+                if data.get("type") == "result":
+                    self.last_used = time.monotonic()
+                    return data
+        finally:
+            killer.cancel()
+
+        # stdout closed without a result: either we killed it, or it died
+        self.closed = True
+        if self.timed_out:
+            raise subprocess.TimeoutExpired(self.proc.args, CLI_TIMEOUT)
+        returncode = self.proc.wait()
+        self._stderr_reader.join(timeout=1)
+        raise self._error(f"claude exited with code {returncode}")
+
+    def _error(self, message: str) -> CliStreamError:
+        if self.stderr_tail:
+            message += ": " + " | ".join(self.stderr_tail)
+        return CliStreamError(message, silent=not self.saw_output, resumed=self.resumed)
+
+    def close(self):
+        self.closed = True
+        try:
+            self.proc.stdin.close()
+        except OSError:
+            pass
+        self.proc.terminate()
+        try:
+            self.proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+
+
+def _get_cli_process(sender_hash: str, session_id: str | None) -> CliProcess:
+    # Closing waits for the process to exit, so it happens after cli_procs_lock
+    # is released; idle processes stay locked until then so nobody reuses them.
+    dead = None
+    idle = []
+    with cli_procs_lock:
+        proc = cli_procs.get(sender_hash)
+        if proc is not None:
+            if proc.alive():
+                cli_procs.move_to_end(sender_hash)
+                return proc
+            dead = proc
+
+        proc = cli_procs[sender_hash] = CliProcess(session_id)
+        cli_procs.move_to_end(sender_hash)
+
+        # Over capacity: stop the least recently used processes that are idle
+        for key, other in list(cli_procs.items()):
+            if len(cli_procs) <= CLI_MAX_PROCS or other is proc:
+                break
+            if other.lock.acquire(blocking=False):
+                idle.append(other)
+                del cli_procs[key]
+
+    if dead is not None:
+        dead.close()
+    _close_locked_cli_processes(idle)
+    return proc
+
+
+def _close_locked_cli_processes(procs: list[CliProcess]):
+    """Close processes whose lock the caller acquired, releasing each lock afterwards."""
+    for proc in procs:
+        try:
+            proc.close()
+        finally:
+            proc.lock.release()
+
+
+def _close_cli_process(sender_hash: str):
+    with cli_procs_lock:
+        proc = cli_procs.pop(sender_hash, None)
+    if proc is not None:
+        with proc.lock:
+            proc.close()
+
+
+def reap_cli_processes(max_idle: float = SENDER_TTL):
+    """Stop persistent claude processes idle for longer than max_idle seconds."""
+    now = time.monotonic()
+    stale = []
+    with cli_procs_lock:
+        for key, proc in list(cli_procs.items()):
+            if proc.alive() and now - proc.last_used <= max_idle:
+                continue
+            if proc.lock.acquire(blocking=False):
+                stale.append(proc)
+                del cli_procs[key]
+    _close_locked_cli_processes(stale)
+
+
+def _cli_reaper():
+    while not shutdown_event.wait(60):
+        reap_cli_processes()
+
+
+def _run_claude_cli_once(session_id: str | None, user_message: str) -> dict:
+    """One-shot `claude -p` call, used when stream-json is unavailable."""
     result = subprocess.run(
-        cmd,
-        input=user_message,
+        _cli_command(_CLI_ONESHOT_CMD, session_id),
+        input=user_message.encode(),
         capture_output=True,
-        text=True,
         timeout=CLI_TIMEOUT,
-        env=env,
+        env=_CLI_ENV,
     )
 
     if result.returncode != 0:
-        raise RuntimeError(result.stderr.strip() or f"Exit code {result.returncode}")
+        raise RuntimeError(result.stderr.decode(errors="replace").strip() or f"Exit code {result.returncode}")
+
+    return _json_loads(result.stdout)
+
+
+def _forget_cli_session(sender_hash: str):
+    with senders_lock:
+        _get_sender(sender_hash).session_id = None
+
 
-    data = json.loads(result.stdout)
+def _run_claude_cli(sender_hash: str, user_message: str) -> str:
+    """Send a message to this sender's claude session, resuming it if one exists."""
+    global cli_stream_supported
+    stripped = user_message.strip()
+
+    # Handle /clear locally
+    if stripped.lower() in ("/clear", "/reset"):
+        with senders_lock:
+            senders.pop(sender_hash, None)
+        _purge_cached_responses(sender_hash)
+        _close_cli_process(sender_hash)
+        return "Conversation cleared."
+
+    with senders_lock:
+        session_id = _get_sender(sender_hash).session_id
+
+    data = None
+    while data is None and cli_stream_supported is not False:
+        try:
+            proc = _get_cli_process(sender_hash, session_id)
+            with proc.lock:
+                data = proc.ask(user_message)
+            cli_stream_supported = True
+        except CliStreamError as e:
+            _close_cli_process(sender_hash)
+            if e.silent and e.resumed:
+                # Most likely a stale session (e.g. restored from state.json)
+                RNS.log(f"Cannot resume Claude CLI session for {sender_hash} ({e}), starting a new one", RNS.LOG_WARNING)
+                _forget_cli_session(sender_hash)
+                session_id = None
+                continue
+            if e.silent and cli_stream_supported is None:
+                RNS.log(f"Claude CLI stream-json unavailable ({e}), using one-shot calls", RNS.LOG_WARNING)
+                cli_stream_supported = False
+            else:
+                RNS.log(f"Claude CLI process for {sender_hash} failed ({e}), retrying one-shot", RNS.LOG_WARNING)
+            break
+
+    if data is None:
+        try:
+            data = _run_claude_cli_once(session_id, user_message)
+        except RuntimeError as e:
+            if not session_id:
+                raise
+            RNS.log(f"Cannot resume Claude CLI session for {sender_hash} ({e}), starting a new one", RNS.LOG_WARNING)
+            _forget_cli_session(sender_hash)
+            session_id = None
+            data = _run_claude_cli_once(session_id, user_message)
+
+    if data.get("is_error"):
+        raise RuntimeError(data.get("result") or data.get("subtype") or "Claude CLI error")
 
     # Store session ID for future resume
-    with cli_sessions_lock:
-        cli_sessions[sender_hash] = data["session_id"]
+    with senders_lock:
+        _get_sender(sender_hash).session_id = data["session_id"]
 
     return data["result"]
 
 
-def get_llm_response(sender_hash: str, user_message: str) -> str:
+def _response_cache_key(sender_hash: str, user_message: str) -> tuple[str, str] | None:
+    normalized = user_message.strip().lower()
+    if len(normalized) < RESPONSE_CACHE_MIN_CHARS or _TIME_SENSITIVE.search(normalized):
+        return None
+
+    # Deep into a conversation the same words ("yes", "go on") mean different
+    # things each time, so long conversations bypass the cache entirely.
+    with senders_lock:
+        state = senders.get(sender_hash)
+        if state is not None and state.turns > CONV_HIST_CACHE_THRESHOLD:
+            return None
+
+    return (sender_hash, normalized)
+
+
+def _get_cached_response(key: tuple[str, str]) -> str | None:
+    with response_cache_lock:
+        entry = response_cache.get(key)
+    if entry is None or time.monotonic() - entry[0] > RESPONSE_CACHE_TTL:
+        return None
+    return entry[1]
+
+
+def _store_cached_response(key: tuple[str, str], text: str):
+    now = time.monotonic()
+    with response_cache_lock:
+        response_cache.pop(key, None)
+        response_cache[key] = (now, text)
+        while (len(response_cache) > RESPONSE_CACHE_MAX
+               or now - next(iter(response_cache.values()))[0] > RESPONSE_CACHE_TTL):
+            response_cache.popitem(last=False)
+
+
+def _purge_cached_responses(sender_hash: str):
+    """Forget a sender's cached replies, e.g. when its conversation is cleared or evicted."""
+    with response_cache_lock:
+        for key in [k for k in response_cache if k[0] == sender_hash]:
+            del response_cache[key]
+
+
+def _count_turn(sender_hash: str):
+    with senders_lock:
+        _get_sender(sender_hash).turns += 1
+
+
+class ReplyStream:
+    """Collects a reply as it is generated and passes it on in sentence-sized chunks.
+
+    `send(text, continuation)` is called whenever at least STREAM_CHUNK_CHARS
+    of unsent text ends at a sentence boundary; `continuation` is False only
+    for the first chunk. The reply is capped to MAX_RESPONSE_CHARS.
+    """
+
+    def __init__(self, send):
+        self.send = send
+        self.text = ""
+        self.sent = 0
+
+    def feed(self, delta: str) -> bool:
+        """Add generated text. Returns False once the reply is long enough to stop generating."""
+        self.text += delta
+        # The tail may still be replaced by "..." on truncation, so hold it back
+        limit = min(len(self.text), _TRUNC_AT)
+        if limit - self.sent >= STREAM_CHUNK_CHARS:
+            end = None
+            for end in _SENTENCE_END.finditer(self.text, self.sent, limit):
+                pass
+            if end is not None and end.end() - self.sent >= STREAM_CHUNK_CHARS:
+                self._emit(end.end())
+        return len(self.text) <= MAX_RESPONSE_CHARS
+
+    def finish(self) -> str:
+        """Send whatever is left and return the full (possibly truncated) reply."""
+        if len(self.text) > MAX_RESPONSE_CHARS:
+            self.text = self.text[:_TRUNC_AT] + "..."
+        self._emit(len(self.text))
+        return self.text
+
+    def _emit(self, end: int):
+        chunk = self.text[self.sent:end]
+        # e.g. the space after a reply's last sentence, which would arrive as an empty message
+        if chunk.strip():
+            self.send(chunk, self.sent > 0)
+        self.sent = end
+
+
+def get_llm_response(sender_hash: str, user_message: str, send) -> str:
+    """Produce the reply to a message, handing it to `send(text, continuation)` as it
+    becomes available. Returns the full reply text."""
+    cache_key = _response_cache_key(sender_hash, user_message)
+    if cache_key is not None:
+        cached = _get_cached_response(cache_key)
+        if cached is not None:
+            if RNS.loglevel >= RNS.LOG_DEBUG:
+                RNS.log(f"Response cache hit for {sender_hash}", RNS.LOG_DEBUG)
+            if backend != "claude-cli":
+                # Keep the history consistent with what the sender saw
+                _commit_turn(sender_hash, _stage_user_turn(sender_hash, user_message), cached)
+            _count_turn(sender_hash)
+            send(cached, False)
+            return cached
+
+    stream = ReplyStream(send)
     try:
         if backend == "claude-cli":
-            assistant_text = _run_claude_cli(sender_hash, user_message)
+            stream.feed(_run_claude_cli(sender_hash, user_message))
         elif backend == "anthropic":
-            assistant_text = _call_anthropic(sender_hash, user_message)
+            _call_anthropic(sender_hash, user_message, stream)
         else:
-            assistant_text = _call_openai(sender_hash, user_message)
-
-        if len(assistant_text) > MAX_RESPONSE_CHARS:
-            assistant_text = assistant_text[:MAX_RESPONSE_CHARS - 3] + "..."
+            _call_openai(sender_hash, user_message, stream)
+        assistant_text = stream.finish()
 
+        if cache_key is not None:
+            _store_cached_response(cache_key, assistant_text)
+        _count_turn(sender_hash)
         return assistant_text
 
     except subprocess.TimeoutExpired:
         RNS.log("Claude CLI timed out", RNS.LOG_ERROR)
-        return "[Bot error: Response timed out. Try again.]"
+        error_text = "[Bot error: Response timed out. Try again.]"
     except Exception as e:
         error_msg = f"Error calling LLM ({backend}): {type(e).__name__}: {e}"
         RNS.log(error_msg, RNS.LOG_ERROR)
-        return f"[Bot error: {type(e).__name__}. Try again later.]"
-
-
-def _get_history(sender_hash: str) -> list[dict]:
-    with conversations_lock:
-        if sender_hash not in conversations:
-            conversations[sender_hash] = []
-        return conversations[sender_hash]
-
-
-def _call_anthropic(sender_hash: str, user_message: str) -> str:
-    history = _get_history(sender_hash)
-    history.append({"role": "user", "content": user_message})
-
-    if len(history) > MAX_HISTORY * 2:
-        history[:] = history[-(MAX_HISTORY * 2):]
-
+        error_text = f"[Bot error: {type(e).__name__}. Try again later.]"
+
+    # Deliver whatever was generated before the failure, then the error
+    stream.finish()
+    send(error_text, False)
+    return error_text
+
+
+def _get_history(sender_hash: str) -> tuple[dict, ...]:
+    """Return an immutable snapshot of a sender's history."""
+    with senders_lock:
+        return _get_sender(sender_hash).history
+
+
+def _stage_user_turn(sender_hash: str, user_message: str) -> tuple[dict, ...]:
+    """Return the sender's history plus the new user turn, without storing it."""
+    history = _get_history(sender_hash) + ({"role": "user", "content": user_message},)
+    return _compact_history(sender_hash, history)
+
+
+def _commit_turn(sender_hash: str, history: tuple[dict, ...], assistant_text: str):
+    """Store a staged history plus the assistant reply as the sender's history."""
+    history += ({"role": "assistant", "content": assistant_text[:MAX_MESSAGE_CHARS]},)
+    with senders_lock:
+        _get_sender(sender_hash).history = history
+
+
+def _compact_history(sender_hash: str, history: tuple[dict, ...]) -> tuple[dict, ...]:
+    """Keep the history small without disturbing the cached prompt prefix.
+
+    History is append-only between trims, so the prompt sent for each turn
+    extends the previous one byte-for-byte and the backend's prompt/KV cache
+    can reuse it. Compaction therefore only rewrites messages at two points:
+
+    - the newly appended message is capped to MAX_MESSAGE_CHARS;
+    - once the history exceeds MAX_HISTORY pairs, the oldest half is dropped
+      (in whole pairs, so it still starts with a user message) and all but the
+      last ARCHIVE_KEEP messages are replaced by a placeholder. The prefix is
+      invalidated at that point anyway, so it costs no extra cache misses.
+    """
+    newest = history[-1]
+    if len(newest["content"]) > MAX_MESSAGE_CHARS:
+        RNS.log(f"Capped message from {sender_hash} to {MAX_MESSAGE_CHARS} chars", RNS.LOG_DEBUG)
+        history = history[:-1] + ({"role": newest["role"], "content": newest["content"][:MAX_MESSAGE_CHARS]},)
+
+    if len(history) <= MAX_HISTORY * 2:
+        return history
+
+    before = sum(len(m["content"]) for m in history)
+    kept = history[max(1, MAX_HISTORY // 2) * 2:]
+    split = max(0, len(kept) - ARCHIVE_KEEP)
+    history = tuple(
+        m if m["content"] == ARCHIVED_CONTENT else {"role": m["role"], "content": ARCHIVED_CONTENT}
+        for m in kept[:split]
+    ) + kept[split:]
+    saved = before - sum(len(m["content"]) for m in history)
+    RNS.log(f"Compacted history for {sender_hash}, saved {saved} chars, prompt cache prefix reset", RNS.LOG_DEBUG)
+    return history
+
+
+def _call_anthropic(sender_hash: str, user_message: str, stream: ReplyStream):
+    history = _stage_user_turn(sender_hash, user_message)
+
+    # Mark the newest turn as a cache breakpoint so that, on the next turn, the
+    # system prompt plus everything up to here is read back from the cache.
+    messages = [*history[:-1], {
+        "role": "user",
+        "content": [
+            {"type": "text", "text": history[-1]["content"], "cache_control": {"type": "ephemeral"}},
+        ],
+    }]
+
+    with llm_client.messages.stream(
+        model=model,
+        max_tokens=MAX_TOKENS,
+        system=ANTHROPIC_SYSTEM,
+        messages=messages,
+    ) as response:
+        complete = True
+        for delta in response.text_stream:
+            if not stream.feed(delta):
+                complete = False
+                break
+
+        if complete and RNS.loglevel >= RNS.LOG_DEBUG:
+            usage = response.get_final_message().usage
+            RNS.log(
+                f"Anthropic prompt cache: read={getattr(usage, 'cache_read_input_tokens', 0) or 0} "
+                f"created={getattr(usage, 'cache_creation_input_tokens', 0) or 0} "
+                f"uncached={usage.input_tokens}",
+                RNS.LOG_DEBUG,
+            )
+
+    _commit_turn(sender_hash, history, stream.text)
+
+
+def _call_openai(sender_hash: str, user_message: str, stream: ReplyStream):
+    history = _stage_user_turn(sender_hash, user_message)
+
+    response = llm_client.chat.completions.create(
+        model=model,
+        messages=[OPENAI_SYSTEM, *history],
+        max_tokens=MAX_TOKENS,
+        # Routes every turn from one sender to the same cache shard on
+        # OpenAI-compatible servers; passed via extra_body so older client
+        # versions and backends that don't know the field still work.
+        extra_body={"prompt_cache_key": sender_hash},
+        stream=True,
+    )
     try:
-        response = llm_client.messages.create(
-            model=model,
-            max_tokens=1024,
-            system=SYSTEM_PROMPT,
-            messages=history,
-        )
-        text = response.content[0].text
-        history.append({"role": "assistant", "content": text})
-        return text
-    except Exception:
-        history.pop()
-        raise
-
-
-def _call_openai(sender_hash: str, user_message: str) -> str:
-    history = _get_history(sender_hash)
-    history.append({"role": "user", "content": user_message})
-
-    if len(history) > MAX_HISTORY * 2:
-        history[:] = history[-(MAX_HISTORY * 2):]
+        for chunk in response:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta and not stream.feed(delta):
+                break
+    finally:
+        response.close()
+
+    _commit_turn(sender_hash, history, stream.text)
+
+
+def send_response(destination_hash: bytes, response_text: str, reply_id=None, continuation: bool = False):
+    """Queue a reply. Replies to one destination within BUNDLE_MS go out as one message.
+
+    A continuation (a later chunk of a streamed reply) is joined directly onto
+    the queued text with the same `reply_id` rather than separated from it, so
+    chunks of different replies never mix. Safe to call from any thread; the
+    work happens on send_loop.
+    """
+    send_loop.call_soon_threadsafe(_queue_response, destination_hash, response_text, reply_id, continuation)
+
+
+def _queue_response(destination_hash: bytes, response_text: str, reply_id, continuation: bool):
+    pending = send_queue.get(destination_hash)
+    if pending is not None:
+        if continuation and reply_id is not None:
+            for entry in reversed(pending):
+                if entry[0] == reply_id:
+                    entry[1] += response_text
+                    return
+        pending.append([reply_id, response_text])
+        return
+
+    send_queue[destination_hash] = [[reply_id, response_text]]
+    task = send_loop.create_task(_flush_send_queue(destination_hash))
+    _send_tasks.add(task)
+    task.add_done_callback(_send_task_done)
+
+
+def _send_task_done(task: asyncio.Task):
+    _send_tasks.discard(task)
+    # Nobody awaits these tasks, so errors must be logged here
+    if task.cancelled():
+        return
+    e = task.exception()
+    if e is not None:
+        RNS.log(f"Error sending queued response(s): {type(e).__name__}: {e}", RNS.LOG_ERROR)
+
+
+def _bundle_messages(texts: list[str]) -> list[str]:
+    bundles = []
+    for text in texts:
+        text = text.strip()
+        if not text:
+            continue
+        if bundles and len(bundles[-1]) + len(BUNDLE_SEPARATOR) + len(text) <= MAX_BUNDLE_CHARS:
+            bundles[-1] += BUNDLE_SEPARATOR + text
+        else:
+            bundles.append(text[:MAX_BUNDLE_CHARS])
+    return bundles
 
-    messages = [{"role": "system", "content": SYSTEM_PROMPT}] + history
-    try:
-        response = llm_client.chat.completions.create(
-            model=model,
-            messages=messages,
-            max_tokens=1024,
-        )
-        text = response.choices[0].message.content
-        history.append({"role": "assistant", "content": text})
-        return text
-    except Exception:
-        history.pop()
-        raise
 
+def _get_lxmf_destination(destination_hash: bytes) -> RNS.Destination | None:
+    """Return a cached outbound destination, or build one if the identity is known."""
+    with dest_cache_lock:
+        entry = dest_cache.get(destination_hash)
+    if entry is not None and time.monotonic() - entry[0] < DEST_CACHE_TTL:
+        return entry[1]
 
-def send_response(destination_hash: bytes, response_text: str):
     dest_identity = RNS.Identity.recall(destination_hash)
     if dest_identity is None:
-        RNS.log("Cannot recall identity for sender, requesting path...", RNS.LOG_WARNING)
-        RNS.Transport.request_path(destination_hash)
-        time.sleep(5)
-        dest_identity = RNS.Identity.recall(destination_hash)
-        if dest_identity is None:
-            RNS.log("Still cannot recall sender identity, dropping response", RNS.LOG_ERROR)
-            return
+        return None
 
     lxmf_dest = RNS.Destination(
         dest_identity,
@@ -210,7 +870,45 @@ def send_response(destination_hash: bytes, response_text: str):
         "lxmf",
         "delivery",
     )
-
+    now = time.monotonic()
+    with dest_cache_lock:
+        # Misses are rare, so purging stale entries here keeps the cache small
+        for key in [k for k, (created, _) in dest_cache.items() if now - created >= DEST_CACHE_TTL]:
+            del dest_cache[key]
+        dest_cache[destination_hash] = (now, lxmf_dest)
+    return lxmf_dest
+
+
+async def _flush_send_queue(destination_hash: bytes):
+    # Replies arriving while this waits are added to the same queue entry,
+    # so there is only one flush per destination and FIFO order is kept.
+    try:
+        await asyncio.sleep(BUNDLE_MS / 1000)
+
+        lxmf_dest = _get_lxmf_destination(destination_hash)
+        if lxmf_dest is None:
+            RNS.log("Cannot recall identity for sender, requesting path...", RNS.LOG_WARNING)
+            RNS.Transport.request_path(destination_hash)
+            await asyncio.sleep(PATH_WAIT)
+            lxmf_dest = _get_lxmf_destination(destination_hash)
+    finally:
+        # Always release the entry, or later replies would never be flushed
+        pending = send_queue.pop(destination_hash, [])
+
+    if lxmf_dest is None:
+        RNS.log(f"Still cannot recall sender identity, dropping {len(pending)} response(s)", RNS.LOG_ERROR)
+        return
+
+    dest_hex = destination_hash.hex()
+    for bundle in _bundle_messages([text for _, text in pending]):
+        try:
+            _deliver(destination_hash, dest_hex, lxmf_dest, bundle)
+        except Exception as e:
+            # Still try the remaining bundles
+            RNS.log(f"Error sending response to <{dest_hex}>: {type(e).__name__}: {e}", RNS.LOG_ERROR)
+
+
+def _deliver(destination_hash: bytes, dest_hex: str, lxmf_dest: RNS.Destination, response_text: str):
     lxm = LXMF.LXMessage(
         lxmf_dest,
         delivery_destination,
@@ -221,28 +919,75 @@ def send_response(destination_hash: bytes, response_text: str):
 
     def outbound_delivery_callback(message):
         if message.state == LXMF.LXMessage.DELIVERED:
-            RNS.log(f"Response delivered to {RNS.prettyhexrep(destination_hash)}", RNS.LOG_INFO)
+            if RNS.loglevel >= RNS.LOG_INFO:
+                RNS.log(f"Response delivered to <{dest_hex}>", RNS.LOG_INFO)
         elif message.state == LXMF.LXMessage.FAILED:
-            RNS.log(f"Response delivery FAILED to {RNS.prettyhexrep(destination_hash)}", RNS.LOG_WARNING)
+            RNS.log(f"Response delivery FAILED to <{dest_hex}>", RNS.LOG_WARNING)
+            with dest_cache_lock:
+                dest_cache.pop(destination_hash, None)
 
     lxm.delivery_callback = outbound_delivery_callback
     lxm_router.handle_outbound(lxm)
-    RNS.log(f"Queued response to {RNS.prettyhexrep(destination_hash)}", RNS.LOG_INFO)
+    if RNS.loglevel >= RNS.LOG_INFO:
+        RNS.log(f"Queued response to <{dest_hex}>", RNS.LOG_INFO)
 
 
 def message_received(message: LXMF.LXMessage):
     sender_hash = message.source_hash
-    sender_hex = RNS.hexrep(sender_hash, delimit=False)
+    sender_hex = sender_hash.hex()
     content = message.content_as_string()
 
-    RNS.log(f"Message from {RNS.prettyhexrep(sender_hash)}: {content}", RNS.LOG_INFO)
+    # These run for every message, so skip building the strings when INFO is off
+    if RNS.loglevel >= RNS.LOG_INFO:
+        RNS.log(f"Message from <{sender_hex}>: {content}", RNS.LOG_INFO)
+
+    reply_id = next(_reply_ids)
+
+    def send(text: str, continuation: bool):
+        send_response(sender_hash, text, reply_id, continuation)
 
     def handle():
-        response = get_llm_response(sender_hex, content)
-        RNS.log(f"LLM response ({len(response)} chars): {response[:100]}...", RNS.LOG_INFO)
-        send_response(sender_hash, response)
+        # The executor discards the Future, so errors must be logged here
+        try:
+            response = get_llm_response(sender_hex, content, send)
+        except Exception as e:
+            RNS.log(f"Error handling message from <{sender_hex}>: {type(e).__name__}: {e}", RNS.LOG_ERROR)
+            return
+        if RNS.loglevel >= RNS.LOG_INFO:
+            RNS.log(f"LLM response ({len(response)} chars): {response[:100]}...", RNS.LOG_INFO)
 
-    threading.Thread(target=handle, daemon=True).start()
+    _submit_turn(sender_hex, handle)
+
+
+def _submit_turn(sender_hex: str, handle):
+    """Run a sender's turns one at a time, in arrival order.
+
+    Each turn then builds on the history the previous one committed, and a
+    resent message can hit the cached reply to the original. Waiting turns
+    are queued here rather than in the executor, so one busy sender occupies
+    at most one worker.
+    """
+    with pending_turns_lock:
+        queue = pending_turns.get(sender_hex)
+        if queue is not None:
+            queue.append(handle)
+            return
+        pending_turns[sender_hex] = deque()
+    executor.submit(_run_turn, sender_hex, handle)
+
+
+def _run_turn(sender_hex: str, handle):
+    try:
+        handle()
+    finally:
+        with pending_turns_lock:
+            queue = pending_turns[sender_hex]
+            if not queue:
+                del pending_turns[sender_hex]
+                return
+            handle = queue.popleft()
+        # Resubmitted rather than run here, so other senders get a turn in between
+        executor.submit(_run_turn, sender_hex, handle)
 
 
 def shutdown_handler(signum, frame):
@@ -251,7 +996,7 @@ def shutdown_handler(signum, frame):
 
 
 def main():
-    global llm_client, backend, model, lxm_router, delivery_destination
+    global llm_client, backend, model, lxm_router, delivery_destination, executor, send_loop
 
     # Auto-detect backend: prefer Claude CLI, then Anthropic API, then OpenAI/Ollama
     if shutil.which("claude"):
@@ -271,8 +1016,13 @@ def main():
         print("  or install the 'openai' package for Ollama support.")
         sys.exit(1)
 
+    executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="handler")
+    send_loop = asyncio.new_event_loop()
+    threading.Thread(target=send_loop.run_forever, name="send", daemon=True).start()
+
     reticulum = RNS.Reticulum()
     identity = get_or_create_identity()
+    load_state()
 
     lxm_router = LXMF.LXMRouter(identity=identity, storagepath=str(STORAGE_PATH))
     lxm_router.register_delivery_callback(message_received)
@@ -287,7 +1037,7 @@ def main():
         app_data=None,
     )
 
-    bot_hash = RNS.hexrep(delivery_destination.hash, delimit=False)
+    bot_hash = delivery_destination.hash.hex()
 
     print()
     print("=" * 60)
@@ -308,11 +1058,24 @@ def main():
     signal.signal(signal.SIGINT, shutdown_handler)
     signal.signal(signal.SIGTERM, shutdown_handler)
 
+    threading.Thread(target=_state_saver, daemon=True).start()
+    if backend == "claude-cli":
+        threading.Thread(target=_cli_reaper, daemon=True).start()
+
     lxm_router.announce(delivery_destination.hash)
     RNS.log("Announced LXMF delivery destination", RNS.LOG_INFO)
 
-    while not shutdown_event.is_set():
-        shutdown_event.wait(timeout=1)
+    shutdown_event.wait()
+
+    executor.shutdown(wait=False, cancel_futures=True)
+    send_loop.call_soon_threadsafe(send_loop.stop)
+    save_state()
+
+    with cli_procs_lock:
+        procs = list(cli_procs.values())
+        cli_procs.clear()
+    for proc in procs:
+        proc.close()
 
     RNS.log("Bot stopped.", RNS.LOG_INFO)
 